@@ -12,6 +12,14 @@ import logging
 import argparse
 import shlex
 import subprocess
+import json
+import threading
+import time
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
 
 parser = argparse.ArgumentParser(description="rgit execute git commands recursively")
 parser.add_argument('-v', '--verbose', action="store_true", default=False)
@@ -54,11 +62,43 @@ status_parser = subparsers.add_parser('status', description='Show the working tr
 status_parser.add_argument('-s', '--summary', dest='summary', action="store_true"
                            , default=False
                            , help='Display summary for each subdirectory')
+status_parser.add_argument('--changed-since-last', dest='changed_since_last', action="store_true"
+                           , default=False
+                           , help='Display only repositories whose state changed since the last run')
+status_parser.add_argument('--snapshot', dest='snapshot', action="store"
+                           , default=os.path.join(os.path.expanduser('~'), '.rgit_snapshot.json')
+                           , help='File to store repositories state used by --changed-since-last. '
+                                  'The default is ~/.rgit_snapshot.json')
 parser.add_argument("--dry-run",
                     action="store_true",
                     dest="dry",
                     default=False,
                     help="Don't execute anything actually. Just display executed commands")
+parser.add_argument("--min-jobs",
+                    action="store",
+                    dest="min_jobs",
+                    type=int,
+                    default=1,
+                    help="Minimal number of git commands executed in parallel. The default is 1")
+parser.add_argument("--max-jobs",
+                    action="store",
+                    dest="max_jobs",
+                    type=int,
+                    default=1,
+                    help="""Maximal number of git commands executed in parallel. The default is 1.
+When greater than --min-jobs the number of parallel commands is adjusted while running: increased
+while commands complete without failures and decreased when they fail or their latency grows""")
+parser.add_argument("--untracked-cache",
+                    dest="untracked_cache",
+                    choices=['config', 'enable'],
+                    default=None,
+                    help="""Speed up detection of untracked files using git untracked cache and fsmonitor.
+Only settings supported by git version and platform and not configured in repository yet are used.
+When config, pass -c core.untrackedCache=true and -c core.fsmonitor=true to each git status invocation,
+the untracked cache filesystem test is not run in this mode.
+When enable, set core.untrackedCache and core.fsmonitor in each repository, core.untrackedCache is
+set to false when git update-index --test-untracked-cache fails.
+Settings active in each repository are displayed after its status""")
 
 """
 http://stackoverflow.com/questions/287871/print-in-terminal-with-colors-using-python
@@ -75,7 +115,7 @@ class ColorFormatter(object):
     ENDC = '\033[0m'
 
     def __init__(self):
-        pass
+        self._lock = threading.Lock()
 
     def normal(self, str):
         return str
@@ -99,11 +139,13 @@ class ColorFormatter(object):
         return '{0}{1}{2}'.format(color, str, self.ENDC)
 
     def println(self, str):
-        sys.stdout.write("{0}\n".format(str))
+        with self._lock:
+            sys.stdout.write("{0}\n".format(str))
         return self
 
     def print_out(self, str):
-        sys.stdout.write("{0}".format(str))
+        with self._lock:
+            sys.stdout.write("{0}".format(str))
         return self
 
     def print_header(self, header):
@@ -212,6 +254,22 @@ class StatusResult(object):
     def behind(self, behind):
         self._behind = behind
 
+    def summary(self):
+        return {
+            'branch': self._branch,
+            'branch_remote': self._branch_remote,
+            'ahead': self._ahead,
+            'behind': self._behind,
+            'unmerged': len(self._unmerged),
+            'modified': len(self._modified),
+            'modified_work_tree': len(self._modified_work_tree),
+            'added': len(self._added),
+            'renamed': len(self._renamed),
+            'untracked': len(self._untracked),
+            'deleted': len(self._deleted),
+            'deleted_work_tree': len(self._deleted_work_tree),
+        }
+
     def add(self, kind, value):
         if kind == StatusResult.DELETED:
             self._deleted.append(value)
@@ -341,11 +399,180 @@ class StatusParser(object):
         return branch, remote
 
 
+class Snapshot(object):
+    def __init__(self, filename):
+        self._filename = filename
+        self._repositories = {}
+        self._seen = set()
+
+    def load(self):
+        if not os.path.exists(self._filename):
+            return self
+        try:
+            with open(self._filename) as f:
+                self._repositories = json.load(f)
+        except (IOError, ValueError) as e:
+            logging.warning("Unable to read snapshot %s: %s", self._filename, e)
+        return self
+
+    def save(self):
+        with open(self._filename, 'w') as f:
+            json.dump(self._repositories, f, indent=1, sort_keys=True)
+        return self
+
+    def changed(self, directory, status):
+        """
+        Mark repository as seen in this run.
+
+        :return: True if status summary differs from the stored one
+        """
+        key = os.path.abspath(directory)
+        self._seen.add(key)
+        return self._repositories.get(key) != status.summary()
+
+    def update(self, directory, status):
+        self._repositories[os.path.abspath(directory)] = status.summary()
+
+    def remove_missing(self, dirname):
+        """
+        Remove repositories below dirname which were not seen in this run.
+
+        :return: list of removed repositories relative to dirname
+        """
+        root = os.path.abspath(dirname)
+        removed = []
+        for key in sorted(self._repositories):
+            if key in self._seen or not (key == root or key.startswith(os.path.join(root, ''))):
+                continue
+            del self._repositories[key]
+            removed.append(os.path.normpath(os.path.join(dirname, os.path.relpath(key, root))))
+        return removed
+
+
+class UntrackedCache(object):
+    UNTRACKED_CACHE = 'core.untrackedCache'
+    FSMONITOR = 'core.fsmonitor'
+    CONFIG = [UNTRACKED_CACHE, FSMONITOR]
+    UNTRACKED_CACHE_VERSION = (2, 8)
+    FSMONITOR_VERSION = (2, 36)
+    DISABLED = ['false', 'no', 'off', '0', '']
+
+    def __init__(self, mode, executor, dry=False):
+        """
+
+        :param mode: None, 'config' or 'enable'
+        :param executor:
+        :param dry: don't report settings as changed, commands are only displayed
+        """
+        self._mode = mode
+        self._executor = executor
+        self._dry = dry
+        self._version = None
+        self._fsmonitor_platform = None
+        self._lock = threading.Lock()
+
+    def prepare(self, directory):
+        """
+        Detect untracked cache and fsmonitor support in repository. Settings already
+        configured in repository are left as they are. In config mode return remaining
+        supported settings as git config options, in enable mode set them in repository.
+        When untracked cache test fails in enable mode core.untrackedCache is set to false,
+        so the test is not repeated.
+
+        :return: tuple of git config options to pass, active settings, settings enabled
+                 and settings disabled now
+        """
+        if self._mode is None:
+            return [], [], [], []
+        supported = self.supported(directory)
+        if not supported:
+            return [], [], [], []
+        configured = self._get_configured(directory)
+        config = []
+        active = []
+        enabled = []
+        disabled = []
+        for name in supported:
+            value = configured.get(name.lower())
+            if value is not None:
+                if value.lower() not in UntrackedCache.DISABLED:
+                    active.append(name)
+                continue
+            if self._mode == 'config':
+                config.append('{0}=true'.format(name))
+                active.append(name)
+                continue
+            value = 'true'
+            if name == UntrackedCache.UNTRACKED_CACHE and not self._test_untracked_cache(directory):
+                value = 'false'
+            returncode, _, _ = self._executor.run(directory, "git config {0} {1}".format(name, value))
+            if returncode != 0 or self._dry:
+                continue
+            if value == 'true':
+                active.append(name)
+                enabled.append(name)
+            else:
+                disabled.append(name)
+        return config, active, enabled, disabled
+
+    def supported(self, directory):
+        """
+        :return: list of config names supported by git for the repository
+        """
+        with self._lock:
+            version = self.get_version(directory)
+            fsmonitor = False
+            first = self._fsmonitor_platform is None
+            if version >= UntrackedCache.FSMONITOR_VERSION and first:
+                fsmonitor = self._test_fsmonitor(directory)
+        if version >= UntrackedCache.FSMONITOR_VERSION and not first and self._fsmonitor_platform:
+            fsmonitor = self._test_fsmonitor(directory)
+        supported = []
+        if version >= UntrackedCache.UNTRACKED_CACHE_VERSION:
+            supported.append(UntrackedCache.UNTRACKED_CACHE)
+        if fsmonitor:
+            supported.append(UntrackedCache.FSMONITOR)
+        return supported
+
+    def get_version(self, directory):
+        if self._version is None:
+            out = self._executor.get_output(directory, 'git --version')
+            tokens = out.split()
+            version = ()
+            if len(tokens) >= 3:
+                parts = tokens[2].split('.')[:2]
+                if all(part.isdigit() for part in parts):
+                    version = tuple(int(part) for part in parts)
+            self._version = version
+        return self._version
+
+    def _test_fsmonitor(self, directory):
+        returncode, _, err = self._executor.run(directory, 'git fsmonitor--daemon status')
+        self._fsmonitor_platform = 'not supported' not in err
+        # 1 means supported but the daemon is not running yet
+        return self._fsmonitor_platform and returncode in (0, 1) and 'incompatible' not in err
+
+    def _get_configured(self, directory):
+        out = self._executor.get_output(directory,
+                                        "git config --get-regexp '^core\\.(untrackedcache|fsmonitor)$'")
+        configured = {}
+        for line in out.splitlines():
+            tokens = line.split(None, 1)
+            if tokens:
+                configured[tokens[0]] = tokens[1].strip() if len(tokens) == 2 else ''
+        return configured
+
+    def _test_untracked_cache(self, directory):
+        returncode, _, _ = self._executor.run(directory, 'git update-index --test-untracked-cache')
+        return returncode == 0
+
+
 class Action(object):
-    def __init__(self, action, remote, executor):
+    def __init__(self, action, remote, executor, config=None):
         self._remote = remote
         self._action = action
         self._executor = executor
+        self._config = config or []
 
     def execute(self, directory, status=None):
         return self._executor.get_output(directory, self.get_command())
@@ -357,7 +584,11 @@ class Action(object):
         return self._action == 'fetch'
 
     def get_command(self):
-        return "git {0} {1}".format(self._action, self.get_options()) + ' '.join(self._remote.split(":"))
+        return "git {0}{1} {2}".format(self.get_config(), self._action, self.get_options()) \
+               + ' '.join(self._remote.split(":"))
+
+    def get_config(self):
+        return ''.join('-c {0} '.format(config) for config in self._config)
 
     def get_options(self):
         return ''
@@ -381,20 +612,22 @@ class PullAction(Action):
 class StatusAction(Action):
     INDENT = '   '
 
-    def __init__(self, remote, executor, formatter, summary=False):
+    def __init__(self, remote, executor, formatter, summary=False, config=None):
         """
 
         :param remote:
         :param executor:
         :param summary:
+        :param config: list of name=value git config options passed with -c
         """
-        Action.__init__(self, 'status', remote, executor)
+        Action.__init__(self, 'status', remote, executor, config)
         self._summary = summary
         self._parser = StatusParser()
         self._formatter = formatter
 
     def execute(self, directory, status=None):
-        status = self.get_status(directory)
+        if status is None:
+            status = self.get_status(directory)
         if self._summary:
             return ''
         return self._format(status, directory)
@@ -467,14 +700,286 @@ class StatusAction(Action):
         return True
 
 
+class ActionStats(object):
+    BASELINE_SAMPLES = 10
+    WINDOW_SAMPLES = 5
+
+    def __init__(self):
+        self._calls = 0
+        self._failures = 0
+        self._total_latency = 0.0
+        self._levels = {}
+        self._window = []
+        self._started = time.time()
+
+    @property
+    def calls(self):
+        return self._calls
+
+    @property
+    def failures(self):
+        return self._failures
+
+    @property
+    def average_latency(self):
+        if self._calls == 0:
+            return 0.0
+        return self._total_latency / self._calls
+
+    @property
+    def throughput(self):
+        elapsed = time.time() - self._started
+        if elapsed <= 0:
+            return 0.0
+        return self._calls / elapsed
+
+    def add(self, latency, failed, level):
+        """
+        Record finished command.
+
+        :param level: number of commands in flight when the command was started
+        """
+        self._calls += 1
+        self._total_latency += latency
+        if failed:
+            self._failures += 1
+            return
+        stats = self._levels.setdefault(level, [0, 0.0])
+        stats[0] += 1
+        stats[1] += latency
+        self._window.append(latency)
+
+    def baseline(self):
+        """
+        Average latency of at least BASELINE_SAMPLES commands started with the lowest
+        number of commands in flight.
+
+        :return: tuple of latency and the highest level included or None if not enough samples
+        """
+        count = 0
+        total = 0.0
+        for level in sorted(self._levels):
+            count += self._levels[level][0]
+            total += self._levels[level][1]
+            if count >= ActionStats.BASELINE_SAMPLES:
+                return total / count, level
+        return None
+
+    def congested(self, level, factor, tolerance, window):
+        """
+        Compare average latency of the last window commands with the baseline. Latency
+        of single commands depends on repository size, averages depend on load.
+
+        :return: True if recent latency exceeds factor times the baseline by more than tolerance seconds
+        """
+        window = max(window, ActionStats.WINDOW_SAMPLES)
+        self._window = self._window[-window:]
+        baseline = self.baseline()
+        if len(self._window) < window or baseline is None or level <= baseline[1]:
+            return False
+        latency = sum(self._window) / len(self._window)
+        return latency > factor * baseline[0] + tolerance
+
+    def reset_window(self):
+        self._window = []
+
+
+class AdaptiveLimiter(object):
+    """
+    Limits number of commands in flight. The limit grows by one after each
+    limit successful commands and is halved on failure or latency growth (AIMD).
+    """
+    LATENCY_FACTOR = 2.0
+    LATENCY_TOLERANCE = 0.05
+
+    def __init__(self, min_jobs, max_jobs):
+        self._min_jobs = min_jobs
+        self._max_jobs = max_jobs
+        self._limit = float(min_jobs)
+        self._in_flight = 0
+        self._epoch = 0
+        self._stats = {}
+        self._condition = threading.Condition()
+
+    @property
+    def limit(self):
+        return int(self._limit)
+
+    def acquire(self):
+        """
+        :return: ticket to pass to release
+        """
+        with self._condition:
+            while self._in_flight >= self.limit:
+                self._condition.wait()
+            self._in_flight += 1
+            return self._epoch, self._in_flight
+
+    def release(self, name, ticket, latency, failed):
+        epoch, level = ticket
+        with self._condition:
+            self._in_flight -= 1
+            stats = self._stats.setdefault(name, ActionStats())
+            stats.add(latency, failed, level)
+            congested = failed or stats.congested(level, AdaptiveLimiter.LATENCY_FACTOR,
+                                                  AdaptiveLimiter.LATENCY_TOLERANCE, self.limit)
+            if congested:
+                # decrease only once for commands started with the same limit
+                if epoch == self._epoch:
+                    self._limit = max(float(self._min_jobs), self._limit / 2)
+                    self._epoch += 1
+                    stats.reset_window()
+                    logging.debug("Decreasing jobs to %d after %s", self.limit, name)
+            else:
+                self._limit = min(float(self._max_jobs), self._limit + 1.0 / self._limit)
+            self._condition.notify_all()
+
+    def report(self):
+        lines = []
+        with self._condition:
+            for name in sorted(self._stats):
+                stats = self._stats[name]
+                lines.append('{0}: {1} calls, {2} failed, {3:.3f}s average latency, {4:.2f} calls/s'.format(
+                    name, stats.calls, stats.failures, stats.average_latency, stats.throughput))
+            lines.append('jobs: {0}'.format(self.limit))
+        return lines
+
+
+def get_git_action(command):
+    args = shlex.split(command)[1:]
+    while len(args) > 0 and args[0].startswith('-'):
+        if args[0] in ('-c', '-C'):
+            args = args[2:]
+        else:
+            args = args[1:]
+    if len(args) == 0:
+        return 'git'
+    return args[0]
+
+
+class AdaptiveExecutor:
+    FATAL = 128
+
+    def __init__(self, executor, limiter):
+        self._executor = executor
+        self._limiter = limiter
+
+    def get_output(self, directory, command):
+        return self.run(directory, command)[1]
+
+    def run(self, directory, command):
+        name = get_git_action(command)
+        ticket = self._limiter.acquire()
+        start = time.time()
+        failed = True
+        try:
+            result = self._executor.run(directory, command)
+            # git exits with 128 on fatal errors like authentication or network failures,
+            # lower codes are answers like no matching config or a merge conflict
+            failed = result[0] < 0 or result[0] >= AdaptiveExecutor.FATAL
+            if failed:
+                logging.debug("%s failed in %s with %d", command, directory, result[0])
+            return result
+        finally:
+            self._limiter.release(name, ticket, time.time() - start, failed)
+
+
+class Scheduler(object):
+    """
+    Runs tasks on worker threads. A task returns a callable or None, the callables
+    are invoked on the calling thread in submission order as soon as they are available.
+    """
+
+    def __init__(self, jobs):
+        self._jobs = jobs
+        self._queue = queue.Queue()
+        self._workers = []
+        self._results = {}
+        self._submitted = 0
+        self._next = 0
+        self._condition = threading.Condition()
+
+    def submit(self, function, *args):
+        if self._jobs <= 1:
+            self._finish(function(*args))
+            return
+        self._queue.put((self._submitted, function, args))
+        self._submitted += 1
+        if len(self._workers) < self._jobs:
+            worker = threading.Thread(target=self._run)
+            worker.daemon = True
+            worker.start()
+            self._workers.append(worker)
+        self._flush()
+
+    def join(self):
+        for _ in self._workers:
+            self._queue.put(None)
+        while self._next < self._submitted:
+            with self._condition:
+                if self._next not in self._results:
+                    self._condition.wait(0.1)
+            self._flush()
+        for worker in self._workers:
+            while worker.is_alive():
+                worker.join(0.1)
+        self._workers = []
+
+    def stop(self):
+        """
+        Drop tasks which were not started yet and let workers exit after the current task.
+        """
+        try:
+            while True:
+                task = self._queue.get_nowait()
+                if task is not None:
+                    with self._condition:
+                        self._results[task[0]] = None
+        except queue.Empty:
+            pass
+        for _ in self._workers:
+            self._queue.put(None)
+
+    def _flush(self):
+        while True:
+            with self._condition:
+                if self._next not in self._results:
+                    return
+                result = self._results.pop(self._next)
+                self._next += 1
+            self._finish(result)
+
+    def _finish(self, result):
+        if result is not None:
+            result()
+
+    def _run(self):
+        while True:
+            task = self._queue.get()
+            if task is None:
+                return
+            index, function, args = task
+            result = None
+            try:
+                result = function(*args)
+            except Exception:
+                logging.exception("Unable to execute %s", args[0])
+            with self._condition:
+                self._results[index] = result
+                self._condition.notify_all()
+
+
 class DryRunExecutor:
     def __init__(self):
         pass
 
     def get_output(self, directory, command):
+        return self.run(directory, command)[1]
+
+    def run(self, directory, command):
         logging.warning("Executing: %s in %s", command, directory)
-        if command.find('git status') != -1:
-            return """## master...origin/master [ahead 1, behind 2]
+        if command.find(' status ') != -1:
+            return 0, """## master...origin/master [ahead 1, behind 2]
 D  COPYING.llvm
  D COPYING.unrar
 R  COPYING.unrar -> COPYING.unra
@@ -482,8 +987,8 @@ R  COPYING.unrar -> COPYING.unra
 A  blabla.file
 AM blabla1.file
 M  COPYING
- M COPYING.lzma"""
-        return ""
+ M COPYING.lzma""", ""
+        return 0, "", ""
 
 
 class SubprocessExecutor:
@@ -491,15 +996,18 @@ class SubprocessExecutor:
         pass
 
     def get_output(self, directory, command):
+        return self.run(directory, command)[1]
+
+    def run(self, directory, command):
         logging.debug("Executing: %s in %s", command, directory)
         args = shlex.split(command)
         git_process = subprocess.Popen(args, stdout=subprocess.PIPE, stderr=subprocess.PIPE, cwd=directory)
         stdout, stderr = git_process.communicate()
-        return stdout
+        return git_process.returncode, stdout, stderr
 
 
-def get_dir_status(dirname, executor):
-    return StatusAction('', executor, None).get_status(dirname)
+def get_dir_status(dirname, executor, config=None):
+    return StatusAction('', executor, None, config=config).get_status(dirname)
 
 
 def get_work_tree(status):
@@ -518,9 +1026,29 @@ def get_work_tree(status):
     return work_tree_state
 
 
-def execute(dirname, action, executor, formatter):
-    status = get_dir_status(dirname, executor)
+def execute(dirname, action, executor, formatter, untracked_cache=None, snapshot=None):
+    output = collect(dirname, action, executor, formatter, untracked_cache, snapshot)
+    if output is not None:
+        output()
+
+
+def collect(dirname, action, executor, formatter, untracked_cache=None, snapshot=None):
+    """
+    Execute action in repository.
+
+    :return: callable printing the result and storing it in snapshot or None if there is nothing to print
+    """
+    config = []
+    active = []
+    enabled = []
+    disabled = []
+    if untracked_cache is not None:
+        config, active, enabled, disabled = untracked_cache.prepare(dirname)
+    status = get_dir_status(dirname, executor, config)
     logging.debug(status)
+    if snapshot is not None and not snapshot.changed(dirname, status):
+        logging.debug("No changes since last run in: %s", dirname)
+        return None
     branch = status.branch
 
     no_changes = (not status.changes)
@@ -535,25 +1063,46 @@ def execute(dirname, action, executor, formatter):
     if work_tree_state is not None:
         result += formatter.fail(work_tree_state)
 
+    if active:
+        result += formatter.info_darker(' [{0}]'.format(', '.join(active)))
+    if enabled:
+        result += formatter.warning(' [enabled {0}]'.format(', '.join(enabled)))
+    if disabled:
+        result += formatter.warning(' [disabled {0}]'.format(', '.join(disabled)))
+
     # Execute requested action
     if safe_to_execute_action:
         command_result = action.execute(dirname, status=status)
         result = result + " {0} \n".format(action.get()) + command_result
 
-    formatter.print_out("-- " + formatter.info_darker(dirname.ljust(55)) + branch + " : " + result)
+    line = "-- " + formatter.info_darker(dirname.ljust(55)) + branch + " : " + result
+
+    def output():
+        formatter.print_out(line)
+        if snapshot is not None:
+            snapshot.update(dirname, status)
+    return output
 
 
-def scan(dirname, action, executor, formatter):
+def report_removed(dirname, snapshot, formatter):
+    for removed in snapshot.remove_missing(dirname):
+        formatter.println("-- " + formatter.info_darker(removed.ljust(55)) + formatter.fail("Removed"))
+
+
+def scan(dirname, action, executor, formatter, untracked_cache=None, snapshot=None, scheduler=None):
     full_path = os.path.join(dirname, '.git')
     if os.path.exists(full_path) and os.path.isdir(full_path):
         logging.info("Found git directory in: %s", dirname)
-        execute(dirname, action, executor, formatter)
+        if scheduler is None:
+            execute(dirname, action, executor, formatter, untracked_cache, snapshot)
+        else:
+            scheduler.submit(collect, dirname, action, executor, formatter, untracked_cache, snapshot)
     else:
         for f in os.listdir(dirname):
             full_path = os.path.join(dirname, f)
             if os.path.isdir(full_path):
                 logging.debug("Entering directory: %s", full_path)
-                scan(full_path, action, executor, formatter)
+                scan(full_path, action, executor, formatter, untracked_cache, snapshot, scheduler)
 
 
 def main_impl(argv):
@@ -567,6 +1116,15 @@ def main_impl(argv):
     executor = SubprocessExecutor()
     if options.dry:
         executor = DryRunExecutor()
+    if options.min_jobs < 1 or options.max_jobs < options.min_jobs:
+        parser.error("jobs must satisfy 1 <= --min-jobs <= --max-jobs")
+    # detection commands have expected failures, they don't take part in adaptive job count
+    untracked_cache = UntrackedCache(options.untracked_cache, executor, options.dry)
+    limiter = None
+    if options.max_jobs > 1:
+        limiter = AdaptiveLimiter(options.min_jobs, options.max_jobs)
+        executor = AdaptiveExecutor(executor, limiter)
+    scheduler = Scheduler(options.max_jobs)
     action = None
     if options.action == 'pull':
         action = PullAction(options.remote, executor, options)
@@ -574,14 +1132,28 @@ def main_impl(argv):
         action = Action("push", options.remote, executor)
     if options.action == 'fetch':
         action = Action("fetch", options.remote, executor)
+    snapshot = None
     if options.action == 'status':
         action = StatusAction(options.remote, executor, formatter, options.summary)
+        if options.changed_since_last:
+            snapshot = Snapshot(options.snapshot).load()
     dirname = options.dirname
     logging.basicConfig(format='[%(levelname)s]: %(message)s', level=verbosity)
     logging.debug("Options %s", options)
     formatter.print_header(HEADER)
     formatter.println("Scanning sub directories of {0}".format(dirname))
-    scan(dirname, action, executor, formatter)
+    try:
+        scan(dirname, action, executor, formatter, untracked_cache, snapshot, scheduler)
+        scheduler.join()
+        if snapshot is not None:
+            report_removed(dirname, snapshot, formatter)
+    finally:
+        scheduler.stop()
+        if snapshot is not None and not options.dry:
+            snapshot.save()
+    if limiter is not None:
+        for line in limiter.report():
+            logging.info(line)
     return 0
 
 
@@ -1,4 +1,10 @@
 #!/usr/bin/env python
+import os
+import random
+import shutil
+import tempfile
+import threading
+import time
 import unittest
 import rgit
 
@@ -116,5 +122,356 @@ AA Both_Added.txt
         self.assertEquals("Deleted by Us.txt", result.unmerged[5].name)
         self.assertEquals("Both_Added.txt", result.unmerged[6].name)
 
+
+class RecordingExecutor(object):
+    def __init__(self, outputs=None):
+        self.commands = []
+        self._outputs = outputs or {}
+
+    def get_output(self, directory, command):
+        return self.run(directory, command)[1]
+
+    def run(self, directory, command):
+        self.commands.append(command)
+        for prefix, output in self._outputs.items():
+            if command.startswith(prefix):
+                if isinstance(output, tuple):
+                    return output
+                return 0, output, ''
+        return 0, '', ''
+
+
+class TestUntrackedCache(unittest.TestCase):
+    version = 'git version 2.39.5\n'
+    not_supported = (128, '', 'fatal: fsmonitor--daemon not supported on this platform\n')
+    not_watching = (1, 'fsmonitor-daemon is not watching', '')
+
+    def test_config(self):
+        executor = RecordingExecutor({'git --version': TestUntrackedCache.version,
+                                      'git fsmonitor--daemon': TestUntrackedCache.not_watching,
+                                      'git -c': '## master'})
+        untracked_cache = rgit.UntrackedCache('config', executor)
+        config, active, enabled, disabled = untracked_cache.prepare('.')
+        self.assertEquals(['core.untrackedCache=true', 'core.fsmonitor=true'], config)
+        self.assertEquals(['core.untrackedCache', 'core.fsmonitor'], active)
+        self.assertEquals([], enabled)
+        self.assertEquals([], disabled)
+        self.assertFalse([command for command in executor.commands if command.startswith('git update-index')])
+        rgit.get_dir_status('.', executor, config)
+        self.assertEquals('git -c core.untrackedCache=true -c core.fsmonitor=true status -sb --porcelain',
+                          executor.commands[-1])
+
+    def test_config_configured(self):
+        executor = RecordingExecutor({'git --version': TestUntrackedCache.version,
+                                      'git fsmonitor--daemon': TestUntrackedCache.not_watching,
+                                      'git config --get-regexp':
+                                          'core.untrackedcache false\ncore.fsmonitor .git/hooks/query-watchman\n'})
+        untracked_cache = rgit.UntrackedCache('config', executor)
+        self.assertEquals(([], ['core.fsmonitor'], [], []), untracked_cache.prepare('.'))
+
+    def test_config_fsmonitor_not_supported(self):
+        executor = RecordingExecutor({'git --version': TestUntrackedCache.version,
+                                      'git fsmonitor--daemon': TestUntrackedCache.not_supported})
+        untracked_cache = rgit.UntrackedCache('config', executor)
+        self.assertEquals(['core.untrackedCache=true'], untracked_cache.prepare('.')[0])
+        self.assertEquals(['core.untrackedCache=true'], untracked_cache.prepare('.')[0])
+        # platform support and version are detected once
+        self.assertEquals(1, executor.commands.count('git --version'))
+        self.assertEquals(1, executor.commands.count('git fsmonitor--daemon status'))
+
+    def test_detect_once_in_parallel(self):
+        class SlowExecutor(RecordingExecutor):
+            def run(self, directory, command):
+                time.sleep(0.01)
+                return RecordingExecutor.run(self, directory, command)
+
+        executor = SlowExecutor({'git --version': TestUntrackedCache.version,
+                                 'git fsmonitor--daemon': TestUntrackedCache.not_supported})
+        untracked_cache = rgit.UntrackedCache('config', executor)
+        threads = [threading.Thread(target=untracked_cache.prepare, args=('.',)) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEquals(1, executor.commands.count('git --version'))
+        self.assertEquals(1, executor.commands.count('git fsmonitor--daemon status'))
+
+    def test_config_old_git(self):
+        executor = RecordingExecutor({'git --version': 'git version 2.30.1\n'})
+        untracked_cache = rgit.UntrackedCache('config', executor)
+        self.assertEquals((['core.untrackedCache=true'], ['core.untrackedCache'], [], []),
+                          untracked_cache.prepare('.'))
+        executor = RecordingExecutor({'git --version': 'git version 1.9.1\n'})
+        untracked_cache = rgit.UntrackedCache('config', executor)
+        self.assertEquals(([], [], [], []), untracked_cache.prepare('.'))
+
+    def test_disabled(self):
+        executor = RecordingExecutor({'git status': '## master'})
+        untracked_cache = rgit.UntrackedCache(None, executor)
+        self.assertEquals(([], [], [], []), untracked_cache.prepare('.'))
+        self.assertEquals([], executor.commands)
+
+    def test_enable(self):
+        executor = RecordingExecutor({'git --version': TestUntrackedCache.version,
+                                      'git fsmonitor--daemon': TestUntrackedCache.not_watching,
+                                      'git config --get-regexp': 'core.untrackedcache true\n'})
+        untracked_cache = rgit.UntrackedCache('enable', executor)
+        self.assertEquals(([], ['core.untrackedCache', 'core.fsmonitor'], ['core.fsmonitor'], []),
+                          untracked_cache.prepare('.'))
+        self.assertEquals('git config core.fsmonitor true', executor.commands[-1])
+
+    def test_enable_dry_run(self):
+        executor = RecordingExecutor({'git --version': TestUntrackedCache.version,
+                                      'git fsmonitor--daemon': TestUntrackedCache.not_watching})
+        untracked_cache = rgit.UntrackedCache('enable', executor, dry=True)
+        self.assertEquals(([], [], [], []), untracked_cache.prepare('.'))
+        self.assertTrue('git config core.fsmonitor true' in executor.commands)
+
+    def test_enable_test_failed(self):
+        outputs = {'git --version': TestUntrackedCache.version,
+                   'git fsmonitor--daemon': TestUntrackedCache.not_supported,
+                   'git update-index --test-untracked-cache': (1, '', '')}
+        executor = RecordingExecutor(outputs)
+        untracked_cache = rgit.UntrackedCache('enable', executor)
+        self.assertEquals(([], [], [], ['core.untrackedCache']), untracked_cache.prepare('.'))
+        self.assertEquals('git config core.untrackedCache false', executor.commands[-1])
+        # the next run finds core.untrackedCache in configuration and doesn't test again
+        outputs['git config --get-regexp'] = 'core.untrackedcache false\n'
+        self.assertEquals(([], [], [], []), untracked_cache.prepare('.'))
+        self.assertEquals(1, executor.commands.count('git update-index --test-untracked-cache'))
+
+    def test_enable_configured(self):
+        executor = RecordingExecutor({'git --version': TestUntrackedCache.version,
+                                      'git fsmonitor--daemon': TestUntrackedCache.not_watching,
+                                      'git config --get-regexp': 'core.untrackedcache false\ncore.fsmonitor true\n'})
+        untracked_cache = rgit.UntrackedCache('enable', executor)
+        self.assertEquals(([], ['core.fsmonitor'], [], []), untracked_cache.prepare('.'))
+        self.assertFalse([command for command in executor.commands if command.startswith('git config core')])
+
+
+class TestSnapshot(unittest.TestCase):
+    def setUp(self):
+        self.dirname = tempfile.mkdtemp()
+        self.filename = os.path.join(self.dirname, 'snapshot.json')
+
+    def tearDown(self):
+        shutil.rmtree(self.dirname)
+
+    def test_update(self):
+        parser = rgit.StatusParser()
+        snapshot = rgit.Snapshot(self.filename).load()
+        self.assertTrue(snapshot.changed('repo', parser.parse(TestStatusParser.modified)))
+        self.assertTrue(snapshot.changed('repo', parser.parse(TestStatusParser.modified)))
+        snapshot.update('repo', parser.parse(TestStatusParser.modified))
+        self.assertFalse(snapshot.changed('repo', parser.parse(TestStatusParser.modified)))
+        self.assertTrue(snapshot.changed('repo', parser.parse(TestStatusParser.branch)))
+        self.assertTrue(snapshot.changed('other', parser.parse(TestStatusParser.modified)))
+
+    def test_save_load(self):
+        parser = rgit.StatusParser()
+        snapshot = rgit.Snapshot(self.filename)
+        snapshot.update('repo', parser.parse(TestStatusParser.deleted))
+        snapshot.save()
+        snapshot = rgit.Snapshot(self.filename).load()
+        self.assertFalse(snapshot.changed('repo', parser.parse(TestStatusParser.deleted)))
+        self.assertTrue(snapshot.changed('repo', parser.parse(TestStatusParser.renamed)))
+
+    def test_load_invalid(self):
+        with open(self.filename, 'w') as f:
+            f.write('not json')
+        snapshot = rgit.Snapshot(self.filename).load()
+        self.assertTrue(snapshot.changed('repo', rgit.StatusParser().parse(TestStatusParser.deleted)))
+
+    def test_remove_missing(self):
+        status = rgit.StatusParser().parse(TestStatusParser.deleted)
+        root = os.path.join(self.dirname, 'work')
+        snapshot = rgit.Snapshot(self.filename)
+        for name in ['work/a', 'work/b', 'work/c/d', 'other']:
+            snapshot.update(os.path.join(self.dirname, name), status)
+        snapshot.changed(os.path.join(root, 'a'), status)
+        self.assertEquals([os.path.join(root, 'b'), os.path.join(root, 'c', 'd')], snapshot.remove_missing(root))
+        self.assertEquals([], snapshot.remove_missing(root))
+        self.assertFalse(snapshot.changed(os.path.join(self.dirname, 'other'), status))
+        self.assertTrue(snapshot.changed(os.path.join(root, 'b'), status))
+
+    def test_update_after_print(self):
+        class FailingFormatter(rgit.ColorFormatter):
+            def print_out(self, str):
+                raise IOError('broken pipe')
+
+        snapshot = rgit.Snapshot(self.filename)
+        executor = RecordingExecutor({'git status': TestStatusParser.modified})
+        self.assertRaises(IOError, rgit.execute, 'repo', None, executor, FailingFormatter(), None, snapshot)
+        # the change was not printed, it must be reported on the next run
+        self.assertTrue(snapshot.changed('repo', rgit.StatusParser().parse(TestStatusParser.modified)))
+        rgit.execute('repo', None, executor, rgit.ColorFormatter(), None, snapshot)
+        self.assertFalse(snapshot.changed('repo', rgit.StatusParser().parse(TestStatusParser.modified)))
+
+
+class FailingExecutor(object):
+    def get_output(self, directory, command):
+        return self.run(directory, command)[1]
+
+    def run(self, directory, command):
+        raise OSError('git not found')
+
+
+class TestAdaptiveLimiter(unittest.TestCase):
+    def test_get_git_action(self):
+        self.assertEquals('status', rgit.get_git_action('git status -sb --porcelain'))
+        self.assertEquals('status', rgit.get_git_action('git -c core.untrackedCache=true -c core.fsmonitor=true status'))
+        self.assertEquals('config', rgit.get_git_action('git config core.fsmonitor true'))
+        self.assertEquals('status', rgit.get_git_action('git -C repo --no-pager status'))
+        self.assertEquals('git', rgit.get_git_action('git --version'))
+
+    def simulate(self, limiter, name, calls, latency, failed=False):
+        """
+        Keep limit commands in flight and release the oldest one, latency is a function of commands in flight.
+
+        :return: list of limits after each release
+        """
+        in_flight = []
+        limits = []
+        for _ in range(calls):
+            while len(in_flight) < limiter.limit:
+                in_flight.append(limiter.acquire())
+            limiter.release(name, in_flight.pop(0), latency(len(in_flight) + 1), failed)
+            limits.append(limiter.limit)
+        for ticket in in_flight:
+            limiter.release(name, ticket, latency(1), failed)
+        return limits
+
+    def test_increase(self):
+        limiter = rgit.AdaptiveLimiter(1, 3)
+        self.assertEquals(1, limiter.limit)
+        self.simulate(limiter, 'status', 10, lambda level: 0.01)
+        self.assertEquals(3, limiter.limit)
+
+    def test_increase_repository_latency(self):
+        # latency depends on repository size but not on load
+        rand = random.Random(1)
+        limiter = rgit.AdaptiveLimiter(1, 16)
+        limits = self.simulate(limiter, 'fetch', 300, lambda level: rand.uniform(0.05, 0.8))
+        self.assertEquals(16, max(limits))
+        self.assertEquals(16, limiter.limit)
+
+    def test_decrease_load_latency(self):
+        # latency grows with number of commands in flight
+        rand = random.Random(1)
+        limiter = rgit.AdaptiveLimiter(1, 16)
+        limits = self.simulate(limiter, 'status', 300, lambda level: level * rand.uniform(0.1, 0.2))
+        self.assertTrue(max(limits[100:]) < 16)
+        self.assertTrue(min(limits[100:]) < max(limits[100:]))
+
+    def test_decrease_on_failure(self):
+        limiter = rgit.AdaptiveLimiter(1, 8)
+        self.simulate(limiter, 'fetch', 100, lambda level: 0.01)
+        self.assertEquals(8, limiter.limit)
+        tickets = [limiter.acquire() for _ in range(3)]
+        for ticket in tickets:
+            limiter.release('fetch', ticket, 0.01, True)
+        self.assertEquals(4, limiter.limit)
+
+    def test_decrease_on_latency(self):
+        limiter = rgit.AdaptiveLimiter(2, 8)
+        self.simulate(limiter, 'status', 100, lambda level: 0.01)
+        self.assertEquals(8, limiter.limit)
+        self.simulate(limiter, 'status', 8, lambda level: 5.0)
+        self.assertEquals(4, limiter.limit)
+
+    def test_executor(self):
+        limiter = rgit.AdaptiveLimiter(1, 2)
+        executor = rgit.AdaptiveExecutor(RecordingExecutor({'git status': '## master'}), limiter)
+        self.assertEquals('## master', executor.get_output('.', 'git status -sb --porcelain'))
+        executor = rgit.AdaptiveExecutor(FailingExecutor(), limiter)
+        self.assertRaises(OSError, executor.get_output, '.', 'git fetch')
+        report = limiter.report()
+        self.assertTrue(report[0].startswith('fetch: 1 calls, 1 failed'))
+        self.assertTrue(report[1].startswith('status: 1 calls, 0 failed'))
+
+    def test_untracked_cache_probes(self):
+        limiter = rgit.AdaptiveLimiter(1, 8)
+        self.simulate(limiter, 'status', 100, lambda level: 0.01)
+        self.assertEquals(8, limiter.limit)
+        executor = RecordingExecutor({'git --version': TestUntrackedCache.version,
+                                      'git fsmonitor--daemon': TestUntrackedCache.not_supported,
+                                      'git config --get-regexp': (1, '', ''),
+                                      'git -c': '## master'})
+        untracked_cache = rgit.UntrackedCache('config', executor)
+        adaptive_executor = rgit.AdaptiveExecutor(executor, limiter)
+        for name in ['a', 'b', 'c']:
+            rgit.collect(name, None, adaptive_executor, rgit.ColorFormatter(), untracked_cache)
+        self.assertEquals(8, limiter.limit)
+        report = limiter.report()
+        self.assertEquals(2, len(report))
+        self.assertTrue(report[0].startswith('status:'))
+        self.assertTrue(' 0 failed' in report[0])
+
+    def test_executor_return_code(self):
+        limiter = rgit.AdaptiveLimiter(1, 8)
+        self.simulate(limiter, 'fetch', 100, lambda level: 0.01)
+        self.assertEquals(8, limiter.limit)
+        executor = rgit.AdaptiveExecutor(RecordingExecutor({
+            'git fetch': (128, '', 'fatal: Authentication failed'),
+            'git config': (1, '', '')}), limiter)
+        self.assertEquals((1, '', ''), executor.run('.', "git config --get core.fsmonitor"))
+        self.assertEquals(8, limiter.limit)
+        self.assertEquals((128, '', 'fatal: Authentication failed'), executor.run('.', 'git fetch'))
+        self.assertEquals(4, limiter.limit)
+        report = limiter.report()
+        self.assertTrue(report[0].startswith('config: 1 calls, 0 failed'))
+        self.assertTrue(report[1].startswith('fetch:'))
+        self.assertTrue(', 1 failed' in report[1])
+
+
+class TestScheduler(unittest.TestCase):
+    def test_submit(self):
+        results = []
+        scheduler = rgit.Scheduler(4)
+        for i in range(20):
+            scheduler.submit(results.append, i)
+        scheduler.join()
+        self.assertEquals(list(range(20)), sorted(results))
+
+    def test_order(self):
+        output = []
+
+        def task(i):
+            # later tasks finish first
+            time.sleep(0.002 * (20 - i))
+            return lambda: output.append(i)
+
+        scheduler = rgit.Scheduler(4)
+        for i in range(20):
+            scheduler.submit(task, i)
+        scheduler.join()
+        self.assertEquals(list(range(20)), output)
+
+    def test_failed_task(self):
+        output = []
+
+        def task(i):
+            if i == 1:
+                raise RuntimeError('failed')
+            return lambda: output.append(i)
+
+        scheduler = rgit.Scheduler(2)
+        for i in range(3):
+            scheduler.submit(task, i)
+        scheduler.join()
+        self.assertEquals([0, 2], output)
+
+    def test_stop(self):
+        started = []
+        scheduler = rgit.Scheduler(2)
+        event = threading.Event()
+        for i in range(10):
+            scheduler.submit(lambda i: started.append(i) or event.wait() and None, i)
+        scheduler.stop()
+        event.set()
+        scheduler.join()
+        self.assertTrue(len(started) <= 2)
+
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file